@@ -6,10 +6,11 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # LangChain / LangGraph
-from langchain_groq import ChatGroq
-from langgraph.prebuilt import create_react_agent
 from langchain_core.tools import tool
-from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage, HumanMessage
+
+# Shared agent setup (system prompt, Groq client, stream parsing)
+from safespace.agent import SYSTEM_PROMPT, build_session_context, create_agent, get_therapist_llm, stream_response
 
 # Optional Twilio (only if secrets are provided)
 try:
@@ -18,41 +19,37 @@ except Exception:
     TwilioClient = None
 
 # ---- Environment only (avoid st.secrets when not configured) ----
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_FROM_NUMBER = os.getenv("TWILIO_FROM_NUMBER")
 
-# ---- LLMs ----
-if GROQ_API_KEY:
-    main_llm = ChatGroq(model="openai/gpt-oss-20b", groq_api_key=GROQ_API_KEY, temperature=0.7, top_p=0.9)
-    therapist_llm = ChatGroq(model="openai/gpt-oss-20b", groq_api_key=GROQ_API_KEY, temperature=0.7, top_p=0.9)
-else:
-    main_llm = None
-    therapist_llm = None
-
-# ---- System Prompt ----
-SYSTEM_PROMPT = """
-You are "Friday", an AI mental health assistant with three modes of operation:
-1. **General Q&A Mode**: If the user is asking a factual, casual, or non-emotional question, respond directly without using any tools.
-2. **Therapeutic Mode**: If the user shares emotional concerns, mental health struggles, or seeks personal guidance, use the `ask_mental_health_specialist` tool.
-3. **Emergency Mode**: If the user mentions suicidal thoughts, self-harm, or being in immediate danger, IMMEDIATELY call the `call_emergency_services` tool.
-
-Rules for Decision Making:
-- Always first assess the emotional and safety level of the user's message.
-- If the situation involves emotional distress but not immediate danger → Use `ask_mental_health_specialist`.
-- If there are any indicators of self-harm, suicide, or danger to self/others → Use `call_emergency_services` without hesitation.
-- Otherwise, answer directly as a friendly and helpful AI.
-
-Tone Guidelines:
-- Empathetic, warm, and understanding for all emotional interactions.
-- Concise and clear for general queries.
-- Urgent and safety-focused for emergencies.
-
-You have access to:
-- ask_mental_health_specialist(prompt: str)
-- call_emergency_services(phone: str)
-"""
+# Streamlit re-executes this script on every interaction; clients and the agent graph are kept in
+# st.cache_resource so they are built once per process instead of once per rerun.
+
+# ---- Twilio client (built once so emergency calls reuse its HTTP connection pool) ----
+@st.cache_resource
+def get_twilio_client():
+    if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_FROM_NUMBER and TwilioClient:
+        return TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    return None
+
+twilio_client = get_twilio_client()
+
+# ---- LLM ----
+# The agent routes with a small model (see safespace.agent); the therapist tool uses the larger one.
+# Cached in safespace.agent, so reruns (and the backend, if imported in the same process) reuse one client
+therapist_llm = get_therapist_llm()
+
+# ---- Conversation History ----
+# Only the latest turns are sent back to the agent so the prompt stays bounded as the chat grows
+HISTORY_TURNS = 6
+
+def build_history_context(messages) -> str:
+    """Recent chat turns as a compact system message ("" when there is no prior conversation)."""
+    recent = messages[-HISTORY_TURNS:]
+    if not recent:
+        return ""
+    return "Most recent messages:\n" + "\n".join(f"- {m['role']}: {m['content']}" for m in recent)
 
 # ---- Tools ----
 @tool
@@ -101,14 +98,13 @@ def call_emergency_services(phone: str) -> str:
     Place an emergency call to the provided phone number via Twilio (if configured).
     Use this ONLY if the user expresses suicidal thoughts, self-harm, immediate danger, or a mental health crisis.
     """
-    if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_FROM_NUMBER and TwilioClient):
+    if twilio_client is None:
         return (
             "Emergency call could not be initiated because telephony is not configured. "
             "Please dial your local emergency number immediately."
         )
     try:
-        client = TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        call = client.calls.create(
+        call = twilio_client.calls.create(
             to=phone,
             from_=TWILIO_FROM_NUMBER,
             url="http://demo.twilio.com/docs/voice.xml",
@@ -125,28 +121,16 @@ def call_emergency_services(phone: str) -> str:
 TOOLS = [ask_mental_health_specialist, call_emergency_services]
 
 # ---- Agent Graph ----
-graph = create_react_agent(main_llm, tools=TOOLS) if main_llm is not None else None
-
-# ---- Stream parsing (adapted from backend) ----
-def parse_response(stream):
-    tool_called_name = "None"
-    final_response = ""
-    for step in stream:
-        messages_to_process = []
-        if "__root__" in step and isinstance(step["__root__"], dict) and "messages" in step["__root__"]:
-            messages_to_process.extend(step["__root__"]["messages"])
-        elif "agent" in step and isinstance(step["agent"], dict) and "messages" in step["agent"]:
-            messages_to_process.extend(step["agent"]["messages"])
-        for msg in messages_to_process:
-            if isinstance(msg, BaseMessage):
-                if hasattr(msg, "tool_calls") and msg.tool_calls:
-                    if msg.tool_calls[0].get("name"):
-                        tool_called_name = msg.tool_calls[0]["name"]
-                if isinstance(msg.content, str):
-                    final_response += msg.content
-    return tool_called_name, final_response.strip()
+@st.cache_resource
+def get_graph():
+    return create_agent(TOOLS)
+
+graph = get_graph()
 
 # ---- Streamlit UI (Chat-only) ----
+# Number of chat messages rendered per page; older ones are loaded on demand
+HISTORY_WINDOW = 50
+
 st.set_page_config(page_title="SafeSpace - Friday", page_icon="🧠", layout="centered")
 st.title("🧠 SafeSpace • Friday")
 st.caption("Confidential mental health support. This interface provides chat only.")
@@ -160,6 +144,8 @@ if "phone" not in st.session_state:
     st.session_state.phone = ""
 if "messages" not in st.session_state:
     st.session_state.messages = []  # list of {role: "user"|"assistant", content: str}
+if "history_window" not in st.session_state:
+    st.session_state.history_window = HISTORY_WINDOW
 
 with st.sidebar:
     st.header("Session")
@@ -176,6 +162,7 @@ with st.sidebar:
         st.session_state.name = name.strip() or "there"
         st.session_state.phone = phone.strip()
         st.session_state.messages = []
+        st.session_state.history_window = HISTORY_WINDOW
         greeting = (
             f"Hello {st.session_state.name}, I'm Friday. We can chat here. "
             f"If you ever indicate an emergency, I may attempt to call the provided number for help."
@@ -184,15 +171,23 @@ with st.sidebar:
 
     if clear:
         st.session_state.messages = []
-
-# Display current chat history
-for m in st.session_state.messages:
+        st.session_state.history_window = HISTORY_WINDOW
+
+# Display current chat history (latest HISTORY_WINDOW messages; older ones load on demand)
+hidden = len(st.session_state.messages) - st.session_state.history_window
+if hidden > 0:
+    if st.button(f"Load earlier messages ({hidden} hidden)"):
+        st.session_state.history_window += HISTORY_WINDOW
+        hidden -= HISTORY_WINDOW
+for m in st.session_state.messages[max(hidden, 0):]:
     with st.chat_message(m["role"]):
         st.markdown(m["content"])
 
 # Chat input (only enabled after starting session)
 user_input = st.chat_input("Type your message...", disabled=not st.session_state.session_id)
 if user_input:
+    history_context = build_history_context(st.session_state.messages)
+
     # Show user's message
     st.session_state.messages.append({"role": "user", "content": user_input})
     with st.chat_message("user"):
@@ -201,33 +196,35 @@ if user_input:
     # Build session context
     name = st.session_state.name or "there"
     phone = st.session_state.phone or ""
-    session_context = (
-        f"User name: {name}. User phone: {phone}. "
-        f"When using call_emergency_services(phone), always pass this exact phone number: {phone}. "
-        f"Agent name is Friday."
-    )
+    session_context = build_session_context(name, phone)
 
     # Prepare inputs and get streamed response
-    inputs = {
-        "messages": [
-            ("system", SYSTEM_PROMPT),
-            ("system", session_context),
-            ("user", user_input),
-        ]
-    }
+    messages = [
+        ("system", SYSTEM_PROMPT),
+        ("system", session_context),
+    ]
+    if history_context:
+        messages.append(("system", history_context))
+    messages.append(("user", user_input))
+    inputs = {"messages": messages}
 
     with st.chat_message("assistant"):
         if graph is None:
             st.error("Server not configured. Please set GROQ_API_KEY in your environment and restart.")
             final_response = ""
         else:
-            with st.spinner("Friday is thinking..."):
-                tool_called_name, final_response = parse_response(
-                    graph.stream(inputs, stream_mode="updates")
-                )
-                st.markdown(final_response or "(No response)")
-                if tool_called_name and tool_called_name != "None":
-                    st.caption(f"Tool used: {tool_called_name}")
+            placeholder = st.empty()
+            placeholder.markdown("Friday is thinking...")
+            meta = {}
+            final_response = ""
+            for delta in stream_response(graph.stream(inputs, stream_mode="messages"), meta):
+                final_response += delta
+                placeholder.markdown(final_response)
+            final_response = final_response.strip()
+            placeholder.markdown(final_response or "(No response)")
+            tool_called_name = meta["tool_called"]
+            if tool_called_name and tool_called_name != "None":
+                st.caption(f"Tool used: {tool_called_name}")
 
     # Save assistant message
     st.session_state.messages.append({"role": "assistant", "content": final_response or ""})
@@ -1,11 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 import uvicorn
-from ai_agent import graph, SYSTEM_PROMPT, parse_response
+from ai_agent import get_graph, get_router_llm, SYSTEM_PROMPT, build_session_context, summarize_history, astream_response
+from memory import SessionStore
 from typing import Optional, Literal
-import uuid
+import asyncio
+import orjson
+import os
+import time
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # receive and validate requests from the frontend
 class Query(BaseModel):
@@ -23,8 +30,29 @@ class StartSessionResponse(BaseModel):
     session_id: str
     greeting: str
 
-# In-memory session store
-SESSIONS = {}
+# Persistent session store: user profiles, chat turns and rolling summaries (SQLite)
+SESSIONS = SessionStore()
+
+# Upper bound on the startup warmup so a slow or unreachable Groq API can't hold up the server
+WARMUP_TIMEOUT = 10
+
+@app.on_event("startup")
+async def warm_up():
+    # Compile the agent and open the Groq connection (TLS + HTTP/2 pool) before the first request instead of during it.
+    # The ping goes straight to the router model, which shares the agent's async client but has no tools bound,
+    # so warming up can never trigger a tool (e.g. a real emergency call).
+    start = time.perf_counter()
+    get_graph()
+    llm = get_router_llm()
+    if llm is None:
+        print("Agent warmup skipped: GROQ_API_KEY is not configured")
+        return
+    try:
+        await asyncio.wait_for(llm.ainvoke("ping"), timeout=WARMUP_TIMEOUT)
+        print(f"Agent warmup finished in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        # Warmup is best effort: the first request pays the cost instead
+        print(f"Agent warmup skipped after {time.perf_counter() - start:.2f}s: {e!r}")
 
 @app.get("/")
 def root():  
@@ -32,18 +60,28 @@ def root():
 
 @app.post("/start_session", response_model=StartSessionResponse)
 def start_session(req: StartSessionRequest):
-    session_id = str(uuid.uuid4())
     # Store user data in the session
-    SESSIONS[session_id] = {"name": req.name, "phone": req.phone}
+    session_id = SESSIONS.create_session(req.name, req.phone)
     greeting = (
         f"Hello {req.name}, I'm Friday. We can communicate in two modes: chat or voice. "
         f"You can send messages by typing or speaking, and choose how you'd like me to respond."
     )
     return StartSessionResponse(session_id=session_id, greeting=greeting)
 
+def sse(payload: dict, event: str = "message") -> bytes:
+    """Formats a payload as a single named Server-Sent Events frame."""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(payload) + b"\n\n"
+
 @app.post("/ask")
-def ask_question(query: Query):
-    session = SESSIONS.get(query.session_id)
+async def ask_question(query: Query):
+    # Fail before streaming starts: once the SSE response begins, errors can only truncate the stream
+    graph = get_graph()
+    if graph is None:
+        raise HTTPException(status_code=503, detail="Server not configured. Please set GROQ_API_KEY and restart.")
+
+    # SQLite access is blocking, so it runs in the threadpool to keep the event loop free for other sessions.
+    # (The agent's sync tools - Twilio, Ollama - are already offloaded to an executor by LangChain under astream.)
+    session = await run_in_threadpool(SESSIONS.get_session, query.session_id)
     name = session.get("name") if session else "there"
     phone = session.get("phone") if session else ""
 
@@ -51,29 +89,56 @@ def ask_question(query: Query):
     chosen_mode = query.response_mode or query.input_mode
 
     # Inject session context so the agent passes the correct phone number to emergency tool
-    session_context = (
-        f"User name: {name}. User phone: {phone}. "
-        f"When using call_emergency_services(phone), always pass this exact phone number: {phone}. "
-        f"Agent name is Friday."
-    )
+    session_context = build_session_context(name, phone)
 
-    inputs = {
-        "messages": [
-            ("system", SYSTEM_PROMPT),
-            ("system", session_context),
-            ("user", query.message),
-        ]
-    }
-    # Stream the response from the mock agent (or real agent)
-    tool_called_name, final_response = parse_response(graph.stream(inputs, stream_mode="updates"))
+    messages = [
+        ("system", SYSTEM_PROMPT),
+        ("system", session_context),
+    ]
+    # Only the summary plus relevant/recent turns are sent, so the prompt stays bounded as the chat grows
+    memory_context = (
+        await run_in_threadpool(SESSIONS.build_memory_context, query.session_id, query.message) if session else ""
+    )
+    if memory_context:
+        messages.append(("system", memory_context))
+    messages.append(("user", query.message))
+    inputs = {"messages": messages}
 
-    # Crucial: The key is 'response', which is what the frontend expects.
-    return {
-        "response": final_response,
-        "tool_called": tool_called_name,
-        "response_mode": chosen_mode,
-    }
+    # Stream to the frontend as Server-Sent Events: "tool" frames announce a tool call as soon as the model emits
+    # it (before the tool runs), "message" frames carry token deltas and a final "done" frame closes the stream
+    async def gen():
+        tokens = []
+        async for kind, value in astream_response(graph, inputs):
+            if kind == "token":
+                tokens.append(value)
+                yield sse({"token": value})
+            else:
+                yield sse({"name": value}, event="tool")
+        if session:
+            await run_in_threadpool(SESSIONS.add_turn, query.session_id, "user", query.message)
+            await run_in_threadpool(SESSIONS.add_turn, query.session_id, "assistant", "".join(tokens).strip())
+        yield sse({"response_mode": chosen_mode}, event="done")
 
+    return StreamingResponse(
+        gen(),
+        media_type="text/event-stream",
+        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"},
+        # Summarizing is a separate LLM call, so it runs after the reply has been streamed
+        background=BackgroundTask(SESSIONS.summarize_if_needed, query.session_id, summarize_history) if session else None,
+    )
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # loop/http "auto" pick uvloop and httptools when installed (uvicorn[standard]) and fall back otherwise.
+    # Sessions live in SQLite, so several workers can serve the same users. Each worker also caches profiles until
+    # the session expires, so a session evicted early by one worker may still answer in another (without storing
+    # turns). Reload only works with one worker.
+    workers = int(os.getenv("UVICORN_WORKERS", "1"))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=workers == 1,
+        workers=workers,
+        loop="auto",
+        http="auto",
+    )
@@ -0,0 +1,212 @@
+import os
+import re
+import math
+import time
+import uuid
+import sqlite3
+import threading
+from array import array
+from zlib import crc32
+from typing import Callable, Optional
+from cachetools import TLRUCache
+
+# SQLite file holding session profiles, chat turns and rolling summaries
+DB_PATH = os.getenv("SAFESPACE_DB_PATH", "safespace.db")
+
+EMBED_DIM = 256        # size of the hashed bag-of-words vectors used for retrieval
+RECENT_TURNS = 4       # latest turns always injected verbatim
+TOP_K = 3              # older turns retrieved by similarity to the new message
+SUMMARIZE_EVERY = 8    # unsummarized turns (outside the recent window) that trigger a new summary
+SNIPPET_CHARS = 400    # per-turn cap so the memory message stays bounded
+SESSION_TTL = 24 * 3600      # sessions (and their turns) expire a day after they start
+MAX_SESSIONS = 10_000        # oldest sessions are evicted beyond this
+
+_TOKEN_RE = re.compile(r"\w+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_upto INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    embedding BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_turns_session ON turns (session_id, id);
+CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions (created_at);
+"""
+
+def embed(text: str) -> bytes:
+    """
+    Embeds text as an L2-normalized hashed bag-of-words vector (float32 bytes).
+    Cheap and dependency-free; good enough to pick out earlier turns that share vocabulary with the new message.
+    """
+    vec = array("f", bytes(4 * EMBED_DIM))
+    for token in _TOKEN_RE.findall(text.lower()):
+        vec[crc32(token.encode("utf-8")) % EMBED_DIM] += 1.0
+    norm = math.sqrt(sum(v * v for v in vec))
+    if norm:
+        for i in range(EMBED_DIM):
+            vec[i] /= norm
+    return vec.tobytes()
+
+def _cosine(a: array, b: array) -> float:
+    # Both vectors are normalized, so the dot product is the cosine similarity
+    return sum(x * y for x, y in zip(a, b))
+
+def _snippet(role: str, content: str) -> str:
+    content = " ".join(content.split())
+    if len(content) > SNIPPET_CHARS:
+        content = content[:SNIPPET_CHARS] + "..."
+    return f"- {role}: {content}"
+
+class SessionStore:
+    """
+    Persistent session and conversation memory backed by SQLite.
+    Safe to share across threads; all access goes through a single connection guarded by a lock.
+    Sessions expire after `ttl` seconds and at most `max_sessions` are kept, so the store stays bounded;
+    profiles are also kept in a same-sized in-process cache to skip SQLite on the hot /ask path. Cached
+    entries expire when their session does; a session evicted early by another worker may still be served
+    from this cache until then, but add_turn refuses sessions that are gone, so no orphaned turns are stored.
+    """
+
+    def __init__(self, path: str = DB_PATH, ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._ttl = ttl
+        self._max_sessions = max_sessions
+        # Values are (created_at, profile); each entry expires at the session's own created_at + ttl
+        self._profiles = TLRUCache(maxsize=max_sessions, ttu=lambda _key, value, _now: value[0] + ttl, timer=time.time)
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            # Drop turns whose session is gone (left behind by stores written before add_turn checked this)
+            self._conn.execute("DELETE FROM turns WHERE session_id NOT IN (SELECT session_id FROM sessions)")
+
+    def create_session(self, name: str, phone: str) -> str:
+        session_id = str(uuid.uuid4())
+        created_at = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, name, phone, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, name, phone, created_at),
+            )
+            self._purge()
+            self._profiles[session_id] = (created_at, {"name": name, "phone": phone})
+        return session_id
+
+    def get_session(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            cached = self._profiles.get(session_id)
+            if cached is not None:
+                return cached[1]
+            row = self._conn.execute(
+                "SELECT name, phone, created_at FROM sessions WHERE session_id = ? AND created_at > ?",
+                (session_id, time.time() - self._ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            # Not cached in this process (restart or another worker): cache it until the session expires
+            profile = {"name": row["name"], "phone": row["phone"]}
+            self._profiles[session_id] = (row["created_at"], profile)
+        return profile
+
+    def _purge(self) -> None:
+        """Deletes expired sessions and any beyond max_sessions (oldest first), with their turns. Caller holds the lock."""
+        evicted = self._conn.execute(
+            """
+            SELECT session_id FROM sessions WHERE created_at <= ?
+            UNION
+            SELECT session_id FROM (SELECT session_id FROM sessions ORDER BY created_at DESC LIMIT -1 OFFSET ?)
+            """,
+            (time.time() - self._ttl, self._max_sessions),
+        ).fetchall()
+        if evicted:
+            self._conn.executemany("DELETE FROM turns WHERE session_id = ?", evicted)
+            self._conn.executemany("DELETE FROM sessions WHERE session_id = ?", evicted)
+            for (session_id,) in evicted:
+                self._profiles.pop(session_id, None)
+
+    def add_turn(self, session_id: str, role: str, content: str) -> None:
+        """Stores a turn; a no-op if the session no longer exists (expired or evicted)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO turns (session_id, ts, role, content, embedding)
+                SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE session_id = ?)
+                """,
+                (session_id, time.time(), role, content, embed(content), session_id),
+            )
+
+    def build_memory_context(self, session_id: str, query: str) -> str:
+        """
+        Builds the memory system message for the next turn: the rolling summary, the TOP_K older turns
+        most similar to `query`, and the last RECENT_TURNS turns. Returns "" for a fresh or unknown session.
+        """
+        with self._lock:
+            session = self._conn.execute(
+                "SELECT summary FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if session is None:
+                return ""
+            rows = self._conn.execute(
+                "SELECT id, role, content, embedding FROM turns WHERE session_id = ? ORDER BY id",
+                (session_id,),
+            ).fetchall()
+        if not rows and not session["summary"]:
+            return ""
+
+        recent, older = rows[-RECENT_TURNS:], rows[:-RECENT_TURNS]
+        query_vec = array("f", embed(query))
+        scored = []
+        for row in older:
+            vec = array("f")
+            vec.frombytes(row["embedding"])
+            score = _cosine(query_vec, vec)
+            if score > 0:
+                scored.append((score, row))
+        relevant = sorted(sorted(scored, key=lambda s: s[0], reverse=True)[:TOP_K], key=lambda s: s[1]["id"])
+
+        parts = []
+        if session["summary"]:
+            parts.append(f"Summary of the conversation so far: {session['summary']}")
+        if relevant:
+            parts.append("Relevant earlier messages:\n" + "\n".join(_snippet(r["role"], r["content"]) for _, r in relevant))
+        if recent:
+            parts.append("Most recent messages:\n" + "\n".join(_snippet(r["role"], r["content"]) for r in recent))
+        return "\n\n".join(parts)
+
+    def summarize_if_needed(self, session_id: str, summarizer: Callable[[str, str], str]) -> None:
+        """
+        Folds turns that have left the recent window into the rolling summary once SUMMARIZE_EVERY of them
+        have accumulated. `summarizer(previous_summary, transcript)` returns the new summary.
+        """
+        with self._lock:
+            session = self._conn.execute(
+                "SELECT summary, summarized_upto FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if session is None:
+                return
+            rows = self._conn.execute(
+                "SELECT id, role, content FROM turns WHERE session_id = ? AND id > ? ORDER BY id",
+                (session_id, session["summarized_upto"]),
+            ).fetchall()
+        pending = rows[:-RECENT_TURNS]
+        if len(pending) < SUMMARIZE_EVERY:
+            return
+
+        transcript = "\n".join(f"{r['role']}: {r['content']}" for r in pending)
+        summary = summarizer(session["summary"], transcript)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE sessions SET summary = ?, summarized_upto = ? WHERE session_id = ?",
+                (summary, pending[-1]["id"], session_id),
+            )
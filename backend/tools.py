@@ -1,14 +1,20 @@
+import os
+import textwrap
 import ollama
 from twilio.rest import Client
 # We rely on these being defined in a config.py file
 from config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_FROM_NUMBER
 
-def query_medgemma(prompt: str) -> str:
-    """
-    Calls medgemma model with a therapist personality profile.
-    Returns responses as an empathic mental health therapist.
-    """
-    system_prompt = """
+# Created once at import so every emergency call reuses the same HTTP session (no new TLS handshake per call)
+twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+
+# Persistent Ollama client: its connection is reused across therapeutic replies
+ollama_client = ollama.Client(host=os.getenv("OLLAMA_HOST", "http://localhost:11434"))
+MEDGEMMA_MODEL = 'alibayram/medgemma:4b'
+# Keep the model loaded in memory between calls so replies don't wait for a model reload
+MEDGEMMA_KEEP_ALIVE = "30m"
+
+MEDGEMMA_SYSTEM_PROMPT = textwrap.dedent("""
         You are Dr Julie Stark, a warm and experienced clinical pschologist.
         Respond to patients with:
         
@@ -25,21 +31,27 @@ def query_medgemma(prompt: str) -> str:
         - Mirror the users language and tone
         - Use a warm, empathetic tone
         - Always keep the conversation going by asking open ended questions to dive into root causes of patients problems
+""").strip()
+
+def query_medgemma(prompt: str) -> str:
+    """
+    Calls medgemma model with a therapist personality profile.
+    Returns responses as an empathic mental health therapist.
     """
-    
     try:
         # print("called MedGemma therapist")
-        response = ollama.chat(
-            model='alibayram/medgemma:4b',
+        response = ollama_client.chat(
+            model=MEDGEMMA_MODEL,
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": MEDGEMMA_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             options={
                 'num_predict': 350,
                 'temperature': 0.7,
                 'top_p': 0.9,
-            }
+            },
+            keep_alive=MEDGEMMA_KEEP_ALIVE,
         )
         # Assuming response structure is correct for Ollama
         return response['message']['content'].strip()
@@ -53,11 +65,7 @@ def call_emergency_contact(phone: str) -> str:
     Returns a string indicating the result of the tool action.
     """
     try:
-        client = Client(
-            TWILIO_ACCOUNT_SID,
-            TWILIO_AUTH_TOKEN
-        )
-        call = client.calls.create(
+        call = twilio_client.calls.create(
             to=phone,
             from_=TWILIO_FROM_NUMBER,
             url="http://demo.twilio.com/docs/voice.xml"  # Replace with your TwiML URL
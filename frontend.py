@@ -1,8 +1,14 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
-import json
+import io
+import orjson
+import re
+import wave
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 backend_url = "http://localhost:8000"
@@ -12,6 +18,20 @@ start_session_url = f"{backend_url}/start_session"
 TTS_API_KEY = "" # The environment will provide this
 TTS_MODEL = "gemini-2.5-flash-preview-tts"
 TTS_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{TTS_MODEL}:generateContent?key={TTS_API_KEY}"
+JSON_HEADERS = {'Content-Type': 'application/json'}
+# Sample rate in the TTS mime type, e.g. audio/L16;rate=24000
+RATE_RE = re.compile(r'rate=(\d+)')
+# Voice replies are synthesized sentence by sentence, split after ., ! or ?
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+# ...but not after common abbreviations ("Dr. Stark"), and very short pieces are merged into the next one
+ABBREVIATION_RE = re.compile(r'\b(?:Dr|Mr|Mrs|Ms|Prof|St|Jr|Sr|vs|etc|e\.g|i\.e)\.$', re.IGNORECASE)
+MIN_SPEECH_CHARS = 20
+TTS_WORKERS = 4
+# Number of chat messages rendered per page; older ones are loaded on demand
+HISTORY_WINDOW = 50
+# (connect, read) timeouts. /ask gets a longer read timeout because the stream pauses while a tool runs.
+HTTP_TIMEOUT = (3, 30)
+ASK_TIMEOUT = (3, 120)
 
 st.set_page_config(page_title="SafeSpace - AI Mental Health Therapist", page_icon=":guardsman:", layout="wide")
 st.title("SafeSpace - AI Mental Health Therapist")
@@ -21,11 +41,61 @@ if "session_id" not in st.session_state:
     st.session_state.session_id = None
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "history_window" not in st.session_state:
+    st.session_state.history_window = HISTORY_WINDOW
 if "input_mode" not in st.session_state:
     st.session_state.input_mode = "chat"
 if "response_mode" not in st.session_state:
     st.session_mode = "chat"
 
+# --- HTTP Session ---
+
+@st.cache_resource
+def http():
+    """
+    Shared requests.Session kept across reruns, so calls to the backend and the TTS API
+    reuse keep-alive connections instead of opening a new one per message.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=2, backoff_factor=0.2),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def tts_http():
+    """Dedicated session for TTS, sized so the sentence jobs below can run concurrently."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=TTS_WORKERS)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def tts_executor():
+    """Worker threads that synthesize sentences while the rest of the reply is still streaming."""
+    return ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+
+def iter_sse(response):
+    """
+    Yields (event, data) pairs from a streamed Server-Sent Events response.
+    Frames without an explicit event name default to "message", as in the browser EventSource API.
+    """
+    event, data = "message", None
+    for line in response.iter_lines():
+        if not line:
+            # A blank line terminates the current frame
+            if data is not None:
+                yield event, orjson.loads(data)
+            event, data = "message", None
+        elif line.startswith(b"event: "):
+            event = line[len(b"event: "):].decode()
+        elif line.startswith(b"data: "):
+            data = line[len(b"data: "):]
+
 # --- Utility Functions for TTS (Text-to-Speech) ---
 
 def base64_to_array_buffer(b64_data):
@@ -34,36 +104,43 @@ def base64_to_array_buffer(b64_data):
 
 def pcm_to_wav(pcm_data, sample_rate=24000):
     """
-    Converts 16-bit signed PCM audio data to a WAV Blob/File.
-    The Gemini TTS API returns raw PCM. We need to wrap it in a WAV container.
+    Converts 16-bit signed PCM audio data to WAV bytes.
+    The Gemini TTS API returns raw mono PCM. We wrap it in a WAV container so the browser can play it.
     """
     try:
-        # Convert bytes to Int16Array
-        pcm16 = int.from_bytes(pcm_data, byteorder='little')
-        
-        # WAV file header components
-        num_channels = 1
-        bits_per_sample = 16
-        byte_rate = sample_rate * num_channels * (bits_per_sample // 8)
-        block_align = num_channels * (bits_per_sample // 8)
-        
-        # Placeholder for WAV header logic (complex in pure Streamlit/Python context)
-        # In a real environment, this logic would construct the 44-byte WAV header.
-        
-        # For simplicity in this environment, we'll return the raw data and tell the user.
-        return pcm_data, sample_rate
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)  # 16-bit samples
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframesraw(pcm_data)
+        return buffer.getvalue(), sample_rate
         
     except Exception as e:
         st.error(f"Audio conversion error: {e}")
         return None, None
 
 
-def handle_tts_generation_and_play(text_to_speak, voice_name="Kore"):
+def pop_sentences(text):
     """
-    Handles the full flow: API call, PCM to WAV conversion, and audio playback.
+    Splits the finished sentences off the front of streamed text for TTS.
+    Returns (sentences, remainder); the remainder is kept until more tokens (or the end of the stream) arrive.
+    """
+    sentences, start = [], 0
+    for match in SENTENCE_END_RE.finditer(text):
+        candidate = text[start:match.start()]
+        if len(candidate.strip()) < MIN_SPEECH_CHARS or ABBREVIATION_RE.search(candidate):
+            continue
+        sentences.append(candidate)
+        start = match.end()
+    return sentences, text[start:]
+
+
+def synthesize_speech(session, text_to_speak, voice_name="Kore"):
+    """
+    Calls the TTS API (with retries) and returns (pcm_bytes, sample_rate).
+    Runs on the TTS worker threads, so it raises instead of calling st.* directly.
     """
-    st.info(f"Generating voice response using model: {TTS_MODEL}...")
-    
     # 1. Prepare API Payload
     payload = {
         "contents": [{"parts": [{"text": text_to_speak}]}],
@@ -81,49 +158,65 @@ def handle_tts_generation_and_play(text_to_speak, voice_name="Kore"):
     max_retries = 3
     for i in range(max_retries):
         try:
-            response = requests.post(
+            response = session.post(
                 TTS_API_URL, 
-                headers={'Content-Type': 'application/json'}, 
-                data=json.dumps(payload),
-                timeout=10
+                headers=JSON_HEADERS, 
+                data=orjson.dumps(payload),
+                timeout=HTTP_TIMEOUT
             )
             response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            result = response.json()
+            break
+        except requests.exceptions.RequestException:
+            if i == max_retries - 1:
+                raise
+            time.sleep(2**i)
 
-            part = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0]
-            audio_data_b64 = part.get('inlineData', {}).get('data')
-            mime_type = part.get('inlineData', {}).get('mimeType')
+    result = orjson.loads(response.content)
+    part = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0]
+    audio_data_b64 = part.get('inlineData', {}).get('data')
+    mime_type = part.get('inlineData', {}).get('mimeType')
+    if not (audio_data_b64 and mime_type and mime_type.startswith("audio/L16")):
+        raise ValueError("TTS API response missing audio data.")
 
-            if audio_data_b64 and mime_type and mime_type.startswith("audio/L16"):
-                # 3. Process the audio
-                pcm_data = base64_to_array_buffer(audio_data_b64)
-                
-                # Extract sample rate from mime type (e.g., audio/L16;rate=24000)
-                import re
-                match = re.search(r'rate=(\d+)', mime_type)
-                sample_rate = int(match.group(1)) if match else 24000
-                
-                # In a full Python environment, we'd use pcm_to_wav to get a WAV byte stream.
-                # Here, we simulate by telling the user the data is ready.
-                
-                st.audio(pcm_data, format=mime_type, sample_rate=sample_rate)
-                st.success("Voice response played successfully.")
-                return True
-            else:
-                st.error("TTS API response missing audio data.")
-                return False
+    # 3. Process the audio
+    # Extract sample rate from mime type (e.g., audio/L16;rate=24000)
+    match = RATE_RE.search(mime_type)
+    sample_rate = int(match.group(1)) if match else 24000
+    return base64_to_array_buffer(audio_data_b64), sample_rate
 
-        except requests.exceptions.RequestException as e:
-            if i < max_retries - 1:
-                st.warning(f"TTS API failed (Attempt {i+1}/{max_retries}). Retrying in {2**i} seconds...")
-                time.sleep(2**i)
-            else:
-                st.error(f"TTS API failed after multiple retries. Please check the backend service: {e}")
-                return False
+
+def handle_tts_generation_and_play(speech_jobs):
+    """
+    Waits for the sentence-level TTS jobs (in sentence order), joins their PCM and plays it as one WAV.
+    The jobs are started while the reply is still streaming, so most of them are done by the time we get here.
+    """
+    st.info(f"Generating voice response using model: {TTS_MODEL}...")
+    pcm_chunks = []
+    sample_rate = None
+    for i, job in enumerate(speech_jobs):
+        try:
+            pcm_data, rate = job.result()
         except Exception as e:
-            st.error(f"An unexpected error occurred during TTS processing: {e}")
+            # The reply can't be played in full, so don't spend API calls on the sentences still queued
+            for pending in speech_jobs[i + 1:]:
+                pending.cancel()
+            if isinstance(e, requests.exceptions.RequestException):
+                st.error(f"TTS API failed after multiple retries. Please check the backend service: {e}")
+            else:
+                st.error(f"An unexpected error occurred during TTS processing: {e}")
             return False
-    return False
+        pcm_chunks.append(pcm_data)
+        sample_rate = sample_rate or rate
+
+    if not pcm_chunks:
+        st.error("TTS API response missing audio data.")
+        return False
+
+    wav_bytes, _ = pcm_to_wav(b"".join(pcm_chunks), sample_rate)
+    if wav_bytes is None:
+        return False
+    st.audio(wav_bytes, format="audio/wav")
+    return True
 
 # --- Session Registration View ---
 if st.session_state.session_id is None:
@@ -136,18 +229,20 @@ if st.session_state.session_id is None:
         
         if submitted and user_name and phone_number:
             try:
-                response = requests.post(
+                response = http().post(
                     start_session_url, 
-                    json={"name": user_name, "phone": phone_number}
+                    headers=JSON_HEADERS,
+                    data=orjson.dumps({"name": user_name, "phone": phone_number}),
+                    timeout=HTTP_TIMEOUT
                 )
                 response.raise_for_status() # Check for HTTP errors
                 
-                data = response.json()
+                data = orjson.loads(response.content)
                 st.session_state.session_id = data["session_id"]
                 st.session_state.chat_history.append({"role": "assistant", "content": data["greeting"]})
                 st.rerun()
                 
-            except requests.exceptions.RequestException as e:
+            except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
                 st.error(f"Could not connect to backend or register session. Please ensure your FastAPI server is running at {backend_url}. Error: {e}")
                 
     st.info("Your session ID will be generated upon successful registration.")
@@ -178,12 +273,25 @@ else:
         horizontal=True
     )
 
+    # --- Display Chat History ---
+    # Only the latest messages are rendered so each rerun stays cheap as the conversation grows
+    hidden = len(st.session_state.chat_history) - st.session_state.history_window
+    if hidden > 0:
+        if st.button(f"Load earlier messages ({hidden} hidden)"):
+            st.session_state.history_window += HISTORY_WINDOW
+            hidden -= HISTORY_WINDOW
+    for msg in st.session_state.chat_history[max(hidden, 0):]:
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+
     # --- Chat Input and API Interaction ---
     
     user_input = st.chat_input("What's on your mind today?")
     if user_input:
         # Add user message to history
         st.session_state.chat_history.append({"role": "user", "content": user_input})
+        with st.chat_message("user"):
+            st.markdown(user_input)
 
         # 1. Prepare Payload (Now includes session_id and modes)
         payload = {
@@ -194,31 +302,59 @@ else:
         }
         
         try:
-            with st.spinner("Friday is thinking..."):
-                response = requests.post(ask_url, json=payload)
-                response.raise_for_status() # Check for HTTP errors
-
-            data = response.json()
-            ai_response_text = data.get("response", "Error: No 'response' key found in backend data.")
-            tool_called = data.get("tool_called")
+            ai_response_text = ""
+            tool_called = None
+            # In voice mode each completed sentence is sent to TTS right away, overlapping speech with generation
+            voice_mode = st.session_state.response_mode == "voice"
+            speech_jobs = []
+            pending_speech = ""
+            with st.chat_message("assistant"):
+                # Status line for tool calls, shown while the answer is still being generated
+                status = st.empty()
+                placeholder = st.empty()
+                placeholder.markdown("Friday is thinking...")
+                # The backend streams Server-Sent Events: "tool" calls, "message" token deltas, then "done"
+                with http().post(ask_url, headers=JSON_HEADERS, data=orjson.dumps(payload), stream=True, timeout=ASK_TIMEOUT) as response:
+                    response.raise_for_status() # Check for HTTP errors
+                    for event, data in iter_sse(response):
+                        if event == "message":
+                            ai_response_text += data["token"]
+                            placeholder.markdown(ai_response_text)
+                            if voice_mode:
+                                sentences, pending_speech = pop_sentences(pending_speech + data["token"])
+                                for sentence in sentences:
+                                    speech_jobs.append(tts_executor().submit(synthesize_speech, tts_http(), sentence))
+                        elif event == "tool":
+                            tool_called = data["name"]
+                            status.caption(f"Using tool `{tool_called}`...")
+                        elif event == "done":
+                            break
+                status.empty()
+                if voice_mode and pending_speech.strip():
+                    speech_jobs.append(tts_executor().submit(synthesize_speech, tts_http(), pending_speech))
+                ai_response_text = ai_response_text.strip() or "Error: No response received from the backend."
+                placeholder.markdown(ai_response_text)
             
             # 2. Handle the AI response based on the chosen mode
-            if st.session_state.response_mode == "voice":
+            if voice_mode:
                 # Display the text and then attempt TTS
                 st.session_state.chat_history.append({"role": "assistant", "content": f"**(Voice Response)**: {ai_response_text}"})
                 
                 # --- VOICE GENERATION CALL ---
                 with st.empty(): # Use st.empty() for a temporary audio player/message
-                    handle_tts_generation_and_play(ai_response_text)
+                    handle_tts_generation_and_play(speech_jobs)
                     
             else: # Chat mode
                 st.session_state.chat_history.append({"role": "assistant", "content": ai_response_text})
                 
             # Optional: Notify if a tool was called
             if tool_called:
-                st.session_state.chat_history.append({"role": "system", "content": f"**Tool Called:** `{tool_called}`"})
+                tool_message = f"**Tool Called:** `{tool_called}`"
+                st.session_state.chat_history.append({"role": "system", "content": tool_message})
+                with st.chat_message("system"):
+                    st.markdown(tool_message)
 
-            st.rerun() # Rerun to display the new messages immediately
+            # No st.rerun() here: the new messages are already on screen, and a rerun would redraw the whole history
             
         except requests.exceptions.RequestException as e:
             st.error(f"Network error communicating with the backend: {e}")
@@ -226,8 +362,3 @@ else:
             st.error(f"KeyError in response processing. Did the backend change its output? Key missing: {e}")
         except Exception as e:
             st.error(f"An unexpected error occurred: {e}")
-
-    # --- Display Chat History ---
-    for msg in st.session_state.chat_history:
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
@@ -0,0 +1,158 @@
+import os
+import hashlib
+from functools import lru_cache
+
+import httpx
+from langchain_groq import ChatGroq
+from langgraph.prebuilt import create_react_agent
+from dotenv import load_dotenv
+load_dotenv()
+
+# Shared by the Streamlit app (app.py) and the FastAPI backend (backend/ai_agent.py): the system prompt,
+# the Groq clients and the stream parsers live here once, so a process that imports both builds them once.
+
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+
+# ---- LLMs ----
+# The agent only has to route between answering directly and the two tools, so it runs on a small, fast
+# model; the larger model is reserved for the therapist persona. Both share one HTTP/2 connection pool.
+ROUTER_MODEL = "llama-3.1-8b-instant"
+THERAPIST_MODEL = "openai/gpt-oss-20b"
+
+@lru_cache(maxsize=1)
+def _http_clients():
+    limits = httpx.Limits(max_keepalive_connections=16, max_connections=32)
+    return httpx.Client(limits=limits, http2=True), httpx.AsyncClient(limits=limits, http2=True)
+
+def _groq(model: str, temperature: float):
+    http_client, http_async_client = _http_clients()
+    return ChatGroq(
+        model=model,
+        groq_api_key=GROQ_API_KEY,
+        temperature=temperature,
+        top_p=0.9,
+        max_retries=2,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+@lru_cache(maxsize=1)
+def get_router_llm():
+    """Returns the agent's routing model, or None when GROQ_API_KEY is not configured."""
+    # Low temperature keeps tool-call arguments well formed
+    return _groq(ROUTER_MODEL, temperature=0.2) if GROQ_API_KEY else None
+
+@lru_cache(maxsize=1)
+def get_therapist_llm():
+    """Returns the model behind the therapist tool, or None when GROQ_API_KEY is not configured."""
+    return _groq(THERAPIST_MODEL, temperature=0.7) if GROQ_API_KEY else None
+
+def create_agent(tools):
+    """
+    Compiles the ReAct agent for the given tools (None when the LLM is not configured).
+    Compiling touches the Pydantic schema of every tool, so callers build it once and cache it.
+    """
+    llm = get_router_llm()
+    return create_react_agent(llm, tools=tools) if llm is not None else None
+
+# ---- System Prompt ----
+SYSTEM_PROMPT = """
+You are "Friday", an AI mental health assistant with three modes of operation:
+1. **General Q&A Mode**: If the user is asking a factual, casual, or non-emotional question, respond directly without using any tools.
+2. **Therapeutic Mode**: If the user shares emotional concerns, mental health struggles, or seeks personal guidance, use the `ask_mental_health_specialist` tool.
+3. **Emergency Mode**: If the user mentions suicidal thoughts, self-harm, or being in immediate danger, IMMEDIATELY call the `call_emergency_services` tool.
+
+Rules for Decision Making:
+- Always first assess the emotional and safety level of the user's message.
+- If the situation involves emotional distress but not immediate danger → Use `ask_mental_health_specialist`.
+- If there are any indicators of self-harm, suicide, or danger to self/others → Use `call_emergency_services` without hesitation.
+- Otherwise, answer directly as a friendly and helpful AI.
+
+Tone Guidelines:
+- Empathetic, warm, and understanding for all emotional interactions.
+- Concise and clear for general queries.
+- Urgent and safety-focused for emergencies.
+
+You have access to:
+- ask_mental_health_specialist(prompt: str)
+- call_emergency_services(phone: str)
+
+When using call_emergency_services(phone), always pass the exact user phone number given in the session context.
+""".strip()
+
+# The static prompt is sent first and never interpolated, so Groq's prefix cache can reuse its prefill
+# across turns and sessions. Its fingerprint is printed at import so accidental edits to the prefix are visible.
+SYSTEM_PROMPT_SHA256 = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()
+print(f"SYSTEM_PROMPT: {len(SYSTEM_PROMPT)} chars, sha256={SYSTEM_PROMPT_SHA256[:12]}")
+
+def build_session_context(name: str, phone: str) -> str:
+    """Short per-session system message; kept after SYSTEM_PROMPT so only this part varies."""
+    return f"User name: {name}. User phone: {phone}."
+
+# ---- Stream parsing ----
+def _parse_chunk(chunk, metadata):
+    """
+    Returns the ("tool", name) / ("token", text) items carried by one streamed LLM chunk.
+    Shared by the async event stream (backend) and the sync `stream_mode="messages"` stream (app.py, CLI).
+    """
+    # Only the agent node speaks to the user; tool output (and LLM calls made inside tools) is skipped
+    if metadata.get("langgraph_node") != "agent":
+        return ()
+    # Tool calls are announced from the first streamed chunk that names them, before the tool starts
+    items = [("tool", tc["name"]) for tc in getattr(chunk, "tool_call_chunks", None) or () if tc.get("name")]
+    content = chunk.content
+    if content and type(content) is str:
+        items.append(("token", content))
+    return items
+
+# Typed LangGraph events (astream_events v2) are dispatched through a table; each handler returns the
+# items it produced. Events without a handler are ignored.
+def _on_chat_model_stream(ev):
+    return _parse_chunk(ev["data"]["chunk"], ev["metadata"])
+
+def _on_tool_start(ev):
+    return (("tool", ev["name"]),)
+
+def _ignore(ev):
+    return ()
+
+_EVENT_HANDLERS = {
+    "on_chat_model_stream": _on_chat_model_stream,
+    "on_tool_start": _on_tool_start,
+}
+
+async def astream_response(graph, inputs):
+    """
+    Runs the agent and yields ("tool", name) once per tool it calls and ("token", text) for every
+    text delta of its reply, in the order they happen.
+    """
+    announced = set()
+    async for ev in graph.astream_events(inputs, version="v2"):
+        for kind, value in _EVENT_HANDLERS.get(ev["event"], _ignore)(ev):
+            if kind == "tool":
+                if value in announced:
+                    continue
+                announced.add(value)
+            yield kind, value
+
+def stream_response(stream, meta):
+    """
+    Yield the assistant's text deltas from a `stream_mode="messages"` stream as they arrive.
+    The name of the tool the agent decided to call (if any) is recorded in meta["tool_called"].
+    """
+    meta.setdefault("tool_called", "None")
+    for chunk, metadata in stream:
+        for kind, value in _parse_chunk(chunk, metadata):
+            if kind == "tool":
+                meta["tool_called"] = value
+            else:
+                yield value
+
+def parse_response(graph, inputs):
+    """
+    Runs the agent to completion (for synchronous callers) and returns (tool_called_name, final_response).
+    Uses the sync stream, so it is safe to call repeatedly (no event loop per call).
+    """
+    meta = {}
+    final_response = "".join(stream_response(graph.stream(inputs, stream_mode="messages"), meta))
+    return meta["tool_called"], final_response.strip()